@@ -19,7 +19,8 @@ setuptools.setup(
     install_requires=[
         "xlrd>=2.0.1",
         "pylightxl>=1.54",
-        "XlsxWriter>=1.3.9"
+        "XlsxWriter>=1.3.9",
+        "numpy>=1.19"
     ],
 
     author="Ravi Chandran",
@@ -1,8 +1,11 @@
 #!/usr/bin/env python3
 import os
+import pylightxl
 import pytest
 import subprocess
 
+from xlcompare.xlcompare import numeric_columns_equal
+
 
 TESTDIR = os.path.dirname(os.path.realpath(__file__))
 
@@ -18,12 +21,23 @@ NEW_COLS_CHG = os.path.join(TESTDIR, 'inputs', 'new_columns_change.xlsx')
 OLD_IDTEST = os.path.join(TESTDIR, 'inputs', 'old_idname.xlsx')
 NEW_IDTEST = os.path.join(TESTDIR, 'inputs', 'new_idname.xlsx')
 
+OLD_NUMERIC = os.path.join(TESTDIR, 'inputs', 'old_numeric.xlsx')
+NEW_NUMERIC = os.path.join(TESTDIR, 'inputs', 'new_numeric.xlsx')
+
+DATES_XLS = os.path.join(TESTDIR, 'inputs', 'dates.xls')
+DATES_XLSX = os.path.join(TESTDIR, 'inputs', 'dates.xlsx')
+
+OLD_NUMTEXT = os.path.join(TESTDIR, 'inputs', 'old_numtext.xlsx')
+NEW_NUMTEXT = os.path.join(TESTDIR, 'inputs', 'new_numtext.xlsx')
+
 
 # EXPECTED = os.path.join(TESTDIR, 'expected', 'diffxls.xlsx')
 
 OUTDIFF = os.path.join(TESTDIR, 'diff.xlsx')
 SAVEDIFF1 = os.path.join(TESTDIR, 'save1.xlsx')
 SAVEDIFF2 = os.path.join(TESTDIR, 'save2.xlsx')
+SNAPSHOT = os.path.join(TESTDIR, 'snapshot.json')
+FULLDIFF = os.path.join(TESTDIR, 'fulldiff.xlsx')
 
 
 def rmfile(filepath):
@@ -153,3 +167,215 @@ def test_non_standard_good_id():
     assert 'Deleted rows: 2' in result.stdout
     assert 'Modified rows: 3' in result.stdout
     rmfile(OUTDIFF)
+
+
+def read_diff_rows(filepath):
+    """Read rows of first sheet of differences file."""
+    db = pylightxl.readxl(fn=filepath)
+    return list(db.ws(ws=db.ws_names[0]).rows)
+
+
+# Test numeric comparison with and without tolerance
+def test_numeric_exact():
+    rmfile(OUTDIFF)
+    cmd = ['xlcompare', OLD_NUMERIC, NEW_NUMERIC, '-o', OUTDIFF]
+    result = verify_common(cmd)
+    assert 'Modified rows: 2' in result.stdout
+
+    # changed numbers are shown as old\u2192new, not diffed as text
+    rows = read_diff_rows(OUTDIFF)
+    assert rows[1] == ['N1', 'Widget', '10.1 \u2192 10.1000001', 'Yes']
+    assert rows[2] == ['N2', 'Gadget', '5 \u2192 6', 'Yes']
+    assert rows[3] == ['N3', 'Gizmo', '2.5', 'No']
+    rmfile(OUTDIFF)
+
+
+def test_numeric_abs_tol():
+    rmfile(OUTDIFF)
+    cmd = ['xlcompare', OLD_NUMERIC, NEW_NUMERIC, '-o', OUTDIFF,
+           '--abs-tol', '0.001']
+    result = verify_common(cmd)
+    assert 'Modified rows: 1' in result.stdout
+    rmfile(OUTDIFF)
+
+
+def test_numeric_rel_tol():
+    rmfile(OUTDIFF)
+    cmd = ['xlcompare', OLD_NUMERIC, NEW_NUMERIC, '-o', OUTDIFF,
+           '--rel-tol', '0.5']
+    result = verify_common(cmd)
+    assert 'No differences in common columns found' in result.stdout
+    rmfile(OUTDIFF)
+
+
+def test_numeric_bad_tol():
+    cmd = ['xlcompare', OLD_NUMERIC, NEW_NUMERIC, '-o', OUTDIFF,
+           '--abs-tol', '-1']
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    assert 'tolerances must be non-negative' in result.stderr
+    assert result.returncode == 2
+
+
+def test_numeric_columns_equal():
+    hdr = {'ID': 0, 'Price': 0, 'Note': 0}
+    dct_old = {'1': {'ID': '1', 'Price': 1.0, 'Note': '1'},
+               '2': {'ID': '2', 'Price': 2, 'Note': 'x'},
+               '3': {'ID': '3', 'Price': '', 'Note': ''}}
+    dct_new = {'1': {'ID': '1', 'Price': 1, 'Note': '1'},
+               '2': {'ID': '2', 'Price': 2.01, 'Note': 'y'}}
+    objids = ['1', '2', '3']
+    col_equal = numeric_columns_equal(dct_old, dct_new, objids, hdr)
+    assert list(col_equal) == ['Price']  # ID and Note are text
+    assert list(col_equal['Price']) == [True, False, True]
+
+    col_equal = numeric_columns_equal(dct_old, dct_new, objids, hdr,
+                                      abs_tol=0.02)
+    assert list(col_equal['Price']) == [True, True, True]
+
+    # whitespace is text, not blank, so column is compared as text
+    dct_old['3']['Price'] = ' '
+    col_equal = numeric_columns_equal(dct_old, dct_new, objids, hdr)
+    assert 'Price' not in col_equal
+
+
+# Test date cells with same value across .xls and .xlsx
+def test_dates_xls_vs_xlsx():
+    rmfile(OUTDIFF)
+    cmd = ['xlcompare', DATES_XLS, DATES_XLSX, '-o', OUTDIFF,
+           '--abs-tol', '100']
+    result = verify_common(cmd)
+    assert 'No differences in common columns found' in result.stdout
+
+    rows = read_diff_rows(OUTDIFF)
+    assert rows[1] == ['D1', '2021/01/01', 'Start', 'No']
+    assert rows[2] == ['D2', '2021/02/15 13:45:10', 'Review', 'No']
+    rmfile(OUTDIFF)
+
+
+# Test numeric and text cells with same value across .xls and .xlsx
+def test_numeric_xls_vs_xlsx():
+    rmfile(OUTDIFF)
+    cmd = ['xlcompare', OLD_XLS, OLD_XLSX, '-o', OUTDIFF]
+    result = verify_common(cmd)
+    assert 'No differences in common columns found' in result.stdout
+    rmfile(OUTDIFF)
+
+
+# Test incremental comparison against snapshot of old file
+def test_snapshot():
+    rmfile(OUTDIFF)
+    rmfile(SNAPSHOT)
+    cmd = ['xlcompare', OLD_XLSX, OLD_XLSX, '-o', OUTDIFF,
+           '--snapshot', SNAPSHOT]
+    result = verify_common(cmd)
+    assert 'Saved snapshot' in result.stdout
+    assert os.path.isfile(SNAPSHOT)
+
+    cmd = ['xlcompare', OLD_XLSX, NEW_XLSX, '-o', OUTDIFF,
+           '--snapshot', SNAPSHOT]
+    result = verify_common(cmd)
+    assert OLD_XLSX + ': Reading' not in result.stdout
+    assert 'Deleted rows: 2' in result.stdout
+    assert 'Modified rows: 3' in result.stdout
+
+    # snapshot is now of new file, which is unchanged
+    cmd = ['xlcompare', NEW_XLSX, NEW_XLSX, '-o', OUTDIFF,
+           '--snapshot', SNAPSHOT]
+    result = verify_common(cmd)
+    assert 'Reading 0 changed rows' in result.stdout
+    assert 'No differences in common columns found' in result.stdout
+
+    rmfile(SNAPSHOT)
+    rmfile(OUTDIFF)
+
+
+def statistics(stdout):
+    """Get statistics lines from xlcompare output."""
+    return [s for s in stdout.splitlines()
+            if ' rows: ' in s or s.startswith('No differences')]
+
+
+def verify_snapshot_same_as_full(oldfile, newfile, options=()):
+    """Verify diff using snapshot of oldfile matches diff of full read."""
+    rmfile(FULLDIFF)
+    rmfile(OUTDIFF)
+    rmfile(SNAPSHOT)
+    cmd = ['xlcompare', oldfile, newfile, '-o', FULLDIFF, *options]
+    result_full = subprocess.run(cmd, capture_output=True, text=True)
+
+    cmd = ['xlcompare', oldfile, oldfile, '-o', OUTDIFF,
+           '--snapshot', SNAPSHOT]
+    verify_common(cmd)
+    cmd = ['xlcompare', oldfile, newfile, '-o', OUTDIFF,
+           '--snapshot', SNAPSHOT, *options]
+    result = verify_common(cmd)
+
+    assert read_diff_rows(OUTDIFF) == read_diff_rows(FULLDIFF)
+    assert statistics(result.stdout) == statistics(result_full.stdout)
+
+    rmfile(FULLDIFF)
+    rmfile(OUTDIFF)
+    rmfile(SNAPSHOT)
+    return result
+
+
+def test_snapshot_same_as_full():
+    result = verify_snapshot_same_as_full(OLD_XLSX, NEW_XLSX)
+    assert 'Reading 5 changed rows of 6' in result.stdout
+
+    result = verify_snapshot_same_as_full(OLD_XLS, NEW_XLS)
+    assert 'Reading 5 changed rows of 6' in result.stdout
+
+
+# Text '10' vs number 10 must not be taken as unchanged row
+def test_snapshot_same_as_full_types():
+    result = verify_snapshot_same_as_full(OLD_NUMTEXT, NEW_NUMTEXT,
+                                          ['--abs-tol', '0.001'])
+    assert 'Reading 3 changed rows of 4' in result.stdout
+    assert 'Modified rows: 2' in result.stdout
+
+
+def test_snapshot_columns_change():
+    result = verify_snapshot_same_as_full(OLD_COLS_CHG, NEW_COLS_CHG)
+    assert 'not in new file, comparing all rows' in result.stdout
+
+
+def test_snapshot_truncated():
+    rmfile(OUTDIFF)
+    rmfile(SNAPSHOT)
+    cmd = ['xlcompare', OLD_XLSX, OLD_XLSX, '-o', OUTDIFF,
+           '--snapshot', SNAPSHOT]
+    verify_common(cmd)
+
+    # cut off end of last rows, as an interrupted write would
+    with open(SNAPSHOT, 'rb+') as f:
+        f.truncate(os.path.getsize(SNAPSHOT) - 40)
+
+    cmd = ['xlcompare', OLD_XLSX, NEW_XLSX, '-o', OUTDIFF,
+           '--snapshot', SNAPSHOT]
+    result = verify_common(cmd)
+    assert 'Ignoring unreadable snapshot' in result.stdout
+    assert OLD_XLSX + ': Reading' in result.stdout
+    assert 'Deleted rows: 2' in result.stdout
+    assert 'Modified rows: 3' in result.stdout
+
+    rmfile(SNAPSHOT)
+    rmfile(OUTDIFF)
+
+
+def test_snapshot_of_other_file():
+    rmfile(OUTDIFF)
+    rmfile(SNAPSHOT)
+    cmd = ['xlcompare', OLD_XLS, NEW_XLS, '-o', OUTDIFF,
+           '--snapshot', SNAPSHOT]
+    verify_common(cmd)
+
+    cmd = ['xlcompare', OLD_XLS, NEW_XLS, '-o', OUTDIFF,
+           '--snapshot', SNAPSHOT]
+    result = verify_common(cmd)
+    assert 'Ignoring snapshot of a different file' in result.stdout
+    assert 'Deleted rows: 2' in result.stdout
+    assert 'Modified rows: 3' in result.stdout
+
+    rmfile(SNAPSHOT)
+    rmfile(OUTDIFF)
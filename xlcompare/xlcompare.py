@@ -3,11 +3,15 @@ import argparse
 from collections import OrderedDict
 import difflib
 from enum import IntEnum
+import hashlib
+import json
 import os
 import pylightxl
 import sys
+import tempfile
 
 # Pypi Packages
+import numpy as np
 import xlrd
 import xlsxwriter
 
@@ -171,6 +175,66 @@ def compare_celltext(a, b):
     return cmp, junk
 
 
+def compare_cellnumber(a, b):
+    """Generate formatted old\u2192new string for changed numeric cell."""
+    cmp = [FMT[Fmt.DEL], a, ' \u2192 ', FMT[Fmt.INS], b]
+    return cmp
+
+
+def is_number(value):
+    """Check whether cell value is a native number (not text or boolean)."""
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def value_to_text(value):
+    """Convert native cell value to text for display and text comparison."""
+    if isinstance(value, str):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def column_to_array(dct, objids, heading):
+    """Get values of column as float array aligned by objids.
+
+    Empty cells and missing rows become NaN. Returns None if any other
+    cell in the column is not a number, i.e. the column is compared as text;
+    whitespace-only cells count as text.
+    """
+    values = np.array([dct[objid][heading] if objid in dct else ''
+                       for objid in objids], dtype=object)
+    numbers = np.fromiter(map(is_number, values), bool, len(values))
+    if any(v != '' for v in values[~numbers]):
+        return None
+    arr = np.full(len(values), np.nan)
+    arr[numbers] = values[numbers].astype(float)
+    return arr
+
+
+def numeric_columns_equal(dct_old, dct_new, objids, hdr2width,
+                          abs_tol=0.0, rel_tol=0.0, unchanged=()):
+    """Compare numeric columns with tolerance, one vectorized pass each.
+
+    Returns dictionary of heading to boolean array aligned by objids, for
+    numeric columns only. Tolerance semantics follow math.isclose().
+    Unchanged IDs are not compared, but their new rows still decide
+    whether a column is numeric.
+    """
+    col_equal = {}
+    for s in hdr2width:
+        a = column_to_array(dct_old, objids, s)
+        b = column_to_array(dct_new, objids, s)
+        if a is None or b is None or \
+                column_to_array(dct_new, unchanged, s) is None:
+            continue
+        tol = np.maximum(abs_tol, rel_tol * np.maximum(np.abs(a), np.abs(b)))
+        equal = np.abs(a - b) <= tol
+        equal |= np.isnan(a) & np.isnan(b)
+        col_equal[s] = equal
+    return col_equal
+
+
 def write_cell(ws, row, col, list_out):
     """Write rich string to cell."""
     x = ws.write_rich_string(row, col, *list_out, FMT[Fmt.WRAPBORDER])
@@ -181,8 +245,15 @@ def write_cell(ws, row, col, list_out):
         sys.exit(1)
 
 
-def compare_sheets(ws_out, tbl_old, tbl_new, hdr2width, id_column):
-    """Compare tables from old and new files."""
+def compare_sheets(ws_out, tbl_old, tbl_new, hdr2width, id_column,
+                   abs_tol=0.0, rel_tol=0.0, unchanged=None):
+    """Compare tables from old and new files.
+
+    IDs in unchanged are known to have identical old and new rows, e.g.
+    from a snapshot; they need not be in tbl_old and are not compared.
+    """
+    if unchanged is None:
+        unchanged = set()
     statistics = OrderedDict([
         ('Inserted', 0),
         ('Deleted', 0),
@@ -210,11 +281,22 @@ def compare_sheets(ws_out, tbl_old, tbl_new, hdr2width, id_column):
         if objid not in union_objid:
             union_objid.append(objid)
 
+    # Compare numeric columns up front; these skip text diffing below
+    cmp_objid = [objid for objid in union_objid if objid not in unchanged]
+    col_equal = numeric_columns_equal(dct_old, dct_new, cmp_objid,
+                                      hdr2width, abs_tol, rel_tol,
+                                      list(unchanged))
+    objid2k = {objid: k for k, objid in enumerate(cmp_objid)}
+
     # Loop through all objects
     for objid in union_objid:
         bool_diff = False  # flag to indicate difference exists in row
         bool_row_inserted_deleted = False
-        if objid in dct_new and objid not in dct_old:  # inserted object
+        bool_unchanged = objid in unchanged
+        if bool_unchanged:
+            d_new = dct_new[objid]
+            d_old = d_new
+        elif objid in dct_new and objid not in dct_old:  # inserted object
             d_new = dct_new[objid]
             d_old = blank_d
             statistics['Inserted'] += 1
@@ -231,29 +313,43 @@ def compare_sheets(ws_out, tbl_old, tbl_new, hdr2width, id_column):
         # compare columns for current object
         col = 0
         for i, s in enumerate(hdr2width):
-            if d_new[s] != d_old[s]:
+            t_new = value_to_text(d_new[s])
+            t_old = value_to_text(d_old[s])
+            if bool_unchanged:
+                bool_equal = True
+            elif s in col_equal:
+                bool_equal = col_equal[s][objid2k[objid]]
+            else:
+                bool_equal = t_new == t_old
+
+            if not bool_equal:
                 bool_diff = True
                 visible_cols.add(i)  # mark the column to be visible
 
-            if d_new[s] == '' and d_old[s] == '':
+            if t_new == '' and t_old == '':
                 ws_out.write_blank(row, col, '', FMT[Fmt.WRAPBORDER])
-            elif d_new[s].strip() == '' and d_old[s].strip() == '':
+            elif t_new.strip() == '' and t_old.strip() == '':
                 ws_out.write_blank(row, col, '', FMT[Fmt.WRAPBORDER])
-            elif d_new[s] == d_old[s]:
+            elif bool_equal:
                 ws_out.write_string(row, col,
-                                    replace_bullet(d_old[s]),
+                                    replace_bullet(t_old),
                                     FMT[Fmt.WRAPBORDER])
-            elif d_new[s] == '':
+            elif t_new == '':
                 ws_out.write_string(row, col,
-                                    replace_bullet(d_old[s]),
+                                    replace_bullet(t_old),
                                     FMT[Fmt.DEL])
-            elif d_old[s] == '':
+            elif t_old == '':
                 ws_out.write_string(row, col,
-                                    replace_bullet(d_new[s]),
+                                    replace_bullet(t_new),
                                     FMT[Fmt.INS])
+            elif s in col_equal:
+                list_out = compare_cellnumber(t_old, t_new)
+                ws_out.write_rich_string(row, col,
+                                         *list_out,
+                                         FMT[Fmt.WRAPBORDER])
             else:
-                list_out, junk = compare_celltext(replace_bullet(d_old[s]),
-                                                  replace_bullet(d_new[s]))
+                list_out, junk = compare_celltext(replace_bullet(t_old),
+                                                  replace_bullet(t_new))
                 ws_out.write_rich_string(row, col,
                                          *list_out,
                                          FMT[Fmt.WRAPBORDER])
@@ -331,11 +427,43 @@ def cell_to_text(ws, row, col):
     return value
 
 
+def xldate_to_text(xldate, datemode):
+    """Convert date to text as YYYY/MM/DD, HH:MM:SS or both, like pylightxl.
+
+    pylightxl reads .xlsx dates as such text, so .xls dates must match.
+    """
+    try:
+        y, m, d, hh, mm, ss = xlrd.xldate_as_tuple(xldate, datemode)
+    except xlrd.xldate.XLDateError:
+        return value_to_text(xldate)
+    date = f'{y:04d}/{m:02d}/{d:02d}'
+    time = f'{hh:02d}:{mm:02d}:{ss:02d}'
+    if y == 0:
+        return time
+    if (hh, mm, ss) == (0, 0, 0):
+        return date
+    return date + ' ' + time
+
+
+def cell_to_value(ws, row, col):
+    """Convert cell to native value: float for numbers, else text."""
+    cell_type = ws.cell_type(row, col)
+    if cell_type == xlrd.XL_CELL_NUMBER:
+        value = ws.cell_value(row, col)
+    elif cell_type == xlrd.XL_CELL_DATE:
+        value = xldate_to_text(ws.cell_value(row, col), ws.book.datemode)
+    else:
+        value = cell_to_text(ws, row, col)
+    return value
+
+
 def integerize_column(tbl, heading):
     """Get rid of decimal points and places in ID field if a number."""
     for dct in tbl:
         s = dct[heading]
-        if s.replace('.', '', 1).isdigit():
+        if is_number(s):
+            dct[heading] = str(int(s))
+        elif s.replace('.', '', 1).isdigit():
             dct[heading] = str(int(float(dct[heading])))
 
 
@@ -390,8 +518,9 @@ def read_sheet_xls(ws):
         d = OrderedDict()
         for col in range(ws.ncols):
             h = hdr[col]
-            d[h] = cell_to_text(ws, row, col)
-            hdr2width[h] = estimate_column_width(d[h], hdr2width[h])
+            d[h] = cell_to_value(ws, row, col)
+            hdr2width[h] = estimate_column_width(value_to_text(d[h]),
+                                                 hdr2width[h])
 
         tbl.append(d.copy())
 
@@ -435,14 +564,148 @@ def read_sheet_xlsx(db, ws_name):
         d = OrderedDict()
         for col in range(len(row_data)):
             h = hdr[col]
-            d[h] = str(row_data[col])
-            hdr2width[h] = estimate_column_width(d[h], hdr2width[h])
+            if is_number(row_data[col]):
+                d[h] = row_data[col]
+            else:
+                d[h] = str(row_data[col])
+            hdr2width[h] = estimate_column_width(value_to_text(d[h]),
+                                                 hdr2width[h])
 
         tbl.append(d.copy())
 
     return tbl, hdr2width
 
 
+def read_excel(filepath, id_column):
+    """Read the first sheet of .xls or .xlsx file."""
+    if filepath.endswith('.xls'):
+        return read_xls(filepath, id_column=id_column)
+    return read_xlsx(filepath, id_column=id_column)
+
+
+def snapshot_rows(tbl, headings, id_column):
+    """Get encoded row and its hash for each ID (last row wins).
+
+    Rows are encoded as JSON, so the hash covers cell types as well as
+    text, i.e. the text '10' and the number 10 hash differently.
+    """
+    id2row = OrderedDict()
+    for dct in tbl:
+        line = json.dumps([dct[h] for h in headings],
+                          separators=(',', ':')).encode('utf-8') + b'\n'
+        h = hashlib.blake2b(line, digest_size=16).hexdigest()
+        id2row[dct[id_column]] = (line, h)
+    return id2row
+
+
+def file_signature(filepath):
+    """Get path, size and modification time to detect a changed file."""
+    st = os.stat(filepath)
+    return [os.path.abspath(filepath), st.st_size, st.st_mtime]
+
+
+def write_snapshot(snapfile, filepath, hdr2width, id2row, id_column):
+    """Save snapshot of file's table for comparing against next version.
+
+    First line is the index: ID, offset and hash of each row, and the
+    header set. It is followed by one line per row with its cell values,
+    so changed rows can be read back without reading the rest.
+    """
+    index_rows = []
+    offset = 0
+    for objid, (line, h) in id2row.items():
+        index_rows.append([objid, offset, h])
+        offset += len(line)
+
+    index = {
+        'file': file_signature(filepath),
+        'id_column': id_column,
+        'hdr2width': list(hdr2width.items()),
+        'rows': index_rows,
+        }
+    # write to temporary file first so an interrupted run can't leave a
+    # partly written snapshot behind
+    fd, tmpfile = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(snapfile)), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(json.dumps(index, separators=(',', ':')).encode('utf-8'))
+            f.write(b'\n')
+            for line, h in id2row.values():
+                f.write(line)
+        os.replace(tmpfile, snapfile)
+    except BaseException:
+        os.remove(tmpfile)
+        raise
+
+
+def read_snapshot(snapfile, filepath, id_column):
+    """Load snapshot index if still valid for the given file, else None."""
+    if not os.path.isfile(snapfile):
+        return None
+    try:
+        with open(snapfile, 'rb') as f:
+            line = f.readline()
+            snapshot = json.loads(line.decode('utf-8'))
+    except ValueError:
+        print(f'{snapfile}: Ignoring unreadable snapshot')
+        return None
+    if snapshot.get('file') != file_signature(filepath) or \
+            snapshot.get('id_column') != id_column:
+        print(f'{snapfile}: Ignoring snapshot of a different file')
+        return None
+    snapshot['base'] = len(line)  # start of rows after index
+    return snapshot
+
+
+def read_old_from_snapshot(snapfile, snapshot, tbl_new, hdr2width_new,
+                           id2row_new, id_column):
+    """Read old rows from snapshot, only those whose hashes differ.
+
+    Returns old table of changed and deleted rows, old header widths, and
+    set of IDs whose rows are unchanged in the new table. Returns None if
+    the rows can't be read from the snapshot.
+    """
+    hdr2width_old = OrderedDict(snapshot['hdr2width'])
+    headings = list(hdr2width_old)
+    missing = [h for h in headings if h not in hdr2width_new]
+    if missing:
+        print(f'{snapfile}: Columns {missing} not in new file, '
+              + 'comparing all rows')
+        id2row_new = {}
+    elif headings != list(hdr2width_new):
+        id2row_new = snapshot_rows(tbl_new, headings, id_column)
+
+    unchanged = set()
+    offsets = []
+    for objid, offset, h in snapshot['rows']:
+        if objid in id2row_new and id2row_new[objid][1] == h:
+            unchanged.add(objid)
+        else:
+            offsets.append(offset)
+
+    print(f'{snapfile}: Reading {len(offsets)} changed rows '
+          + f'of {len(snapshot["rows"])}')
+    tbl_old = []
+    try:
+        with open(snapfile, 'rb') as f:
+            for offset in offsets:
+                f.seek(snapshot['base'] + offset)
+                line = f.readline()
+                if not line.endswith(b'\n'):
+                    raise ValueError('short read')
+                values = json.loads(line.decode('utf-8'))
+                if not isinstance(values, list) or \
+                        len(values) != len(headings):
+                    raise ValueError('wrong number of cells')
+                tbl_old.append(OrderedDict(zip(headings, values)))
+    except ValueError:
+        print(f'{snapfile}: Ignoring unreadable snapshot')
+        return None
+
+    return tbl_old, hdr2width_old, unchanged
+
+
 def get_user_inputs():
     """Get user arguments and open files."""
     # get paths of files to be compared
@@ -460,8 +723,24 @@ def get_user_inputs():
     parser.add_argument('--colwidthmax',
                         help='maximum column width in output file',
                         default=50)
+    parser.add_argument('--abs-tol',
+                        help='absolute tolerance for numeric cells',
+                        type=float,
+                        default=0.0)
+    parser.add_argument('--rel-tol',
+                        help='relative tolerance for numeric cells',
+                        type=float,
+                        default=0.0)
+    parser.add_argument('--snapshot',
+                        help='snapshot file; if taken of oldfile, used '
+                        + 'instead of reading oldfile; updated with '
+                        + 'snapshot of newfile',
+                        default=None)
     args = parser.parse_args()
 
+    if args.abs_tol < 0 or args.rel_tol < 0:
+        parser.error('tolerances must be non-negative')
+
     # Verify that files exist
     if not os.path.isfile(args.oldfile):
         print(f'ERROR: {args.oldfile} not found')
@@ -476,16 +755,26 @@ def get_user_inputs():
 def main():
     args = get_user_inputs()
 
+    # Use snapshot of old file, if any, instead of reading old file
+    snapshot = None
+    if args.snapshot:
+        snapshot = read_snapshot(args.snapshot, args.oldfile, args.id)
+
     # Read data from Excel files
-    if args.oldfile.endswith('.xls'):
-        tbl_old, hdr2width_old = read_xls(args.oldfile, id_column=args.id)
-    else:
-        tbl_old, hdr2width_old = read_xlsx(args.oldfile, id_column=args.id)
+    if snapshot is None:
+        tbl_old, hdr2width_old = read_excel(args.oldfile, args.id)
 
-    if args.newfile.endswith('.xls'):
-        tbl_new, hdr2width_new = read_xls(args.newfile, id_column=args.id)
-    else:
-        tbl_new, hdr2width_new = read_xlsx(args.newfile, id_column=args.id)
+    tbl_new, hdr2width_new = read_excel(args.newfile, args.id)
+
+    unchanged = set()
+    if args.snapshot:
+        id2row_new = snapshot_rows(tbl_new, list(hdr2width_new), args.id)
+    if snapshot is not None:
+        old = read_old_from_snapshot(args.snapshot, snapshot, tbl_new,
+                                     hdr2width_new, id2row_new, args.id)
+        if old is None:
+            old = read_excel(args.oldfile, args.id) + (set(),)
+        tbl_old, hdr2width_old, unchanged = old
 
     # Compare header rows
     hdr2width = compare_headers(hdr2width_old, hdr2width_new, args.colwidthmax)
@@ -495,12 +784,19 @@ def main():
     ws_out = write_header_row_xlsx(wb_out, hdr2width)
 
     # Compare sheets
-    compare_sheets(ws_out, tbl_old, tbl_new, hdr2width, args.id)
+    compare_sheets(ws_out, tbl_old, tbl_new, hdr2width, args.id,
+                   args.abs_tol, args.rel_tol, unchanged)
 
     # close and quit
     wb_out.close()
 
     print('Generated', args.outfile)
+
+    if args.snapshot:
+        write_snapshot(args.snapshot, args.newfile, hdr2width_new,
+                       id2row_new, args.id)
+        print('Saved snapshot', args.snapshot)
+
     print('Done.')
 
 